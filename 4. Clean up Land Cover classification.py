@@ -24,7 +24,7 @@
 # 9. the classification is recoded to forest/non-forest; while in the Central African Republic, areas of sparser savanna (shrub savanna) are recoded to forest to adhere to the national forest definition (>10% tree cover)
 # 
 # 
-# the data are visualized and exported to your Google Drive or Asset. 
+# the data are visualized and exported as Cloud Optimized GeoTIFFs to Google Cloud Storage or Asset. 
 
 # In[1]:
 
@@ -36,8 +36,12 @@
 # In[2]:
 
 
+import functools
+from dataclasses import dataclass
+
 import ee
 import geemap
+from IPython.display import display
 import ee.mapclient
 import folium
 
@@ -45,7 +49,8 @@ import folium
 # In[4]:
 
 
-ee.Initialize()
+if not ee.data.is_initialized():
+    ee.Initialize()
 
 
 # Declare input data
@@ -53,125 +58,221 @@ ee.Initialize()
 # In[5]:
 
 
-dem = ee.Image("projects/cafi_fao_congo/regional/NASAdem_congo").select('elevation')
-ucl = ee.Image("projects/cafi_fao_congo/regional/congo_basin_vegetation_UCL")
-optical = ee.Image("projects/cafi_fao_congo/imagery/cafi_optical_mosaic_2013_2015").select('swir1','nir','red')
 fnfaxaparam = {"opacity":1,"bands":["fnf_2015"],"min":1,"max":3,"palette":["0a7e4e","c8ff95","1043ff"]}
-gabon_os = ee.Image("projects/cafi_fao_congo/GAB/OS_GABON_2015").select('b1')
-water = ee.ImageCollection("JRC/GSW1_3/YearlyHistory").select('waterClass')
-class2015 = ee.Image("projects/cafi_fao_congo/classification/cafi_classification_alos").select('class')
-class2015_no_alos = ee.Image('projects/cafi_fao_congo/classification/cafi_classification_no_alos').select('class')
-aoi = ee.FeatureCollection("projects/cafi_fao_congo/regional/aoi_cafi").geometry()#.bounds(),
-ALOS = ee.Image('projects/cafi_fao_congo/alos_mosaic_2015_quegan_rfdi_masked_texture')
-GHSbuiltup = ee.Image("JRC/GHSL/P2016/BUILT_LDSMT_GLOBE_V1").select('built')
-builtup = GHSbuiltup.remap([1,2,3,4,5,6],[0,0,1,1,1,1])
-lsib = ee.FeatureCollection('projects/cafi_fao_congo/regional/congo_basin_lsib')
-countries_raster =ee.Image('projects/cafi_fao_congo/regional/cafi_countries')
-treecover2015 = ee.Image('projects/cafi_fao_congo/regional/treecover_2015_30m')
-not_gabon = countries_raster.neq(6)
-holes = not_gabon.neq(1).And(gabon_os.eq(128)).unmask()
-water_area = water.mosaic().clip(aoi)
-seasonal = water_area.clip(aoi).eq(2).unmask()
-permanent = water_area.clip(aoi).eq(3).unmask()
-annobon = ee.Image('projects/cafi_fao_congo/EQG/annobon_cafi_2014').unmask()
-anno_area = annobon.gt(0).unmask()
-car_cam = countries_raster.eq(2).Or(countries_raster.eq(3))
-mangroves = ee.Image('projects/cafi_fao_congo/classification/cafi_mangroves_2015')
-ESA_worldcover = ee.ImageCollection("ESA/WorldCover/v100")
-
-
-# 1. Recode classes from SEPAL to Code DDD
-
-# In[6]:
-
 
-class_values = ([1,2,3,4,5,6,7,8,9,10,11,12,13,14,15])
-reclass_values = ([1,2,3,4,7,8,9,11,12,13,14,15,16,17,18])
-classDDD = class2015.remap(class_values,reclass_values).unmask()
-classDDD_no_alos = class2015_no_alos.remap([1,2,3,4,5,6,7,8,9,10,11,12,13,14,15],[1,2,3,4,7,8,9,11,12,13,14,15,16,17,18]).unmask()
 
+@dataclass(frozen=True)
+class Inputs:
+    dem: ee.Image
+    ucl: ee.Image
+    optical: ee.Image
+    gabon_os: ee.Image
+    class2015: ee.Image
+    class2015_no_alos: ee.Image
+    aoi: ee.Geometry
+    ALOS: ee.Image
+    GHSbuiltup: ee.Image
+    lsib: ee.FeatureCollection
+    countries_raster: ee.Image
+    treecover2015: ee.Image
+    water_area: ee.Image
+    annobon: ee.Image
+    mangroves: ee.Image
+    ESA_worldcover: ee.ImageCollection
+    mang_buffer: ee.Image
+    terrain_bits: ee.Image
+
+
+# inputs() is cached: rerunning the next cell reuses the same asset handles as long as this cell is not rerun
+@functools.lru_cache(maxsize=1)
+def inputs():
+    return Inputs(
+        dem=ee.Image("projects/cafi_fao_congo/regional/NASAdem_congo").select('elevation'),
+        ucl=ee.Image("projects/cafi_fao_congo/regional/congo_basin_vegetation_UCL"),
+        optical=ee.Image("projects/cafi_fao_congo/imagery/cafi_optical_mosaic_2013_2015").select('swir1','nir','red'),
+        gabon_os=ee.Image("projects/cafi_fao_congo/GAB/OS_GABON_2015").select('b1').unmask(128, False),
+        class2015=ee.Image("projects/cafi_fao_congo/classification/cafi_classification_alos").select('class').unmask(0, False),
+        class2015_no_alos=ee.Image('projects/cafi_fao_congo/classification/cafi_classification_no_alos').select('class').unmask(0, False),
+        aoi=ee.FeatureCollection("projects/cafi_fao_congo/regional/aoi_cafi").geometry(),#.bounds()
+        ALOS=ee.Image('projects/cafi_fao_congo/alos_mosaic_2015_quegan_rfdi_masked_texture'),
+        GHSbuiltup=ee.Image("JRC/GHSL/P2016/BUILT_LDSMT_GLOBE_V1").select('built').unmask(0, False),
+        lsib=ee.FeatureCollection('projects/cafi_fao_congo/regional/congo_basin_lsib'),
+        countries_raster=ee.Image('projects/cafi_fao_congo/regional/cafi_countries').unmask(0, False),
+        treecover2015=ee.Image('projects/cafi_fao_congo/regional/treecover_2015_30m'),
+        water_area=ee.ImageCollection("JRC/GSW1_3/YearlyHistory").filter(ee.Filter.eq('year',2015)).first().select('waterClass').unmask(0, False),
+        annobon=ee.Image('projects/cafi_fao_congo/EQG/annobon_cafi_2014').unmask(0, False).uint8(),
+        mangroves=ee.Image('projects/cafi_fao_congo/classification/cafi_mangroves_2015').unmask(0, False).uint8(),
+        ESA_worldcover=ee.ImageCollection("ESA/WorldCover/v100"),
+        mang_buffer=ee.Image('projects/cafi_fao_congo/regional/esa_mang_buffer500').eq(1).unmask(0, False).uint8(),
+        terrain_bits=ee.Image('projects/cafi_fao_congo/regional/treecover_dem_bits_2015').unmask(0, False),
+    )
 
-# 2. fix ALOS holes
 
-# In[7]:
+# In[ ]:
 
 
-alosholes = classDDD.eq(0).add(1)
-classDDD_fill = classDDD.where(alosholes.eq(2),classDDD_no_alos)
+src = inputs()
+dem = src.dem
+ucl = src.ucl
+optical = src.optical
+gabon_os = src.gabon_os
+class2015 = src.class2015
+class2015_no_alos = src.class2015_no_alos
+aoi = src.aoi
+ALOS = src.ALOS
+GHSbuiltup = src.GHSbuiltup
+builtup = GHSbuiltup.gte(3).uint8()
+lsib = src.lsib
+countries_raster = src.countries_raster
+countries = countries_raster.uint8()
+cam = countries.eq(2)
+car = countries.eq(3)
+gab = countries.eq(6)
+treecover2015 = src.treecover2015
+water_area = src.water_area
+seasonal = water_area.eq(2).uint8()
+permanent = water_area.eq(3).uint8()
+annobon = src.annobon
+car_cam = cam.add(car).uint8()
+mangroves = src.mangroves
+ESA_worldcover = src.ESA_worldcover
+mang_buffer = src.mang_buffer
+terrain_bits = src.terrain_bits
+dense = terrain_bits.bitwiseAnd(1)
+claire = terrain_bits.bitwiseAnd(2)
+montane = terrain_bits.bitwiseAnd(4)
+submontane = terrain_bits.bitwiseAnd(8)
+lowland = terrain_bits.bitwiseAnd(16)
+upland = terrain_bits.bitwiseAnd(32)
+
+
+# Precompute the 500m buffer around ESA Mangrove 2020 used in step 6. This only needs to be run once, the asset is then read above.
 
+# In[ ]:
 
-# 3. fix built up area
 
-# In[8]:
+# the assets are computed on the 30m export grid: a 30m pixel is mangrove if any of its 10m ESA pixels is mangrove
+export_grid = ee.Projection('EPSG:3857').atScale(30)
+ESA_mang = ESA_worldcover.first().eq(95).reduceResolution(ee.Reducer.max(), maxPixels=64).reproject(export_grid)
+buffer_dist = 500
+# a square buffer is the set of pixels within a chebyshev distance of the mangroves, in 30m pixels
+buffer_px = int(round(buffer_dist / 30))
+ESA_mang_buffer = ESA_mang.fastDistanceTransform(256, 'pixels', 'chebyshev').lte(buffer_px)
+mang_buffer_export = ee.batch.Export.image.toAsset(image=ESA_mang_buffer.uint8(),
+                                     description='esa_mang_buffer500',
+                                     assetId='projects/cafi_fao_congo/regional/esa_mang_buffer500',
+                                     pyramidingPolicy={'.default': 'max'},  # coarser levels keep the buffer as a dilation
+                                     region=aoi,
+                                     scale=30,
+                                     crs='EPSG:3857',
+                                     maxPixels=1e13)
 
 
-built17 = ee.Image.constant(17);
-built_wrong = classDDD_fill.eq(17).And(builtup.neq(1))
-class2015_fix = classDDD_fill.where(builtup.eq(1),built17)
-class2015_fix1 = class2015_fix.where(built_wrong.eq(1),15).clip(aoi)
+# In[ ]:
 
 
-# 4. apply treecover for closed and open forest
+#mang_buffer_export.start()
 
-# In[9]:
 
+# Precompute the tree cover and elevation masks used in steps 4 to 6 as the bits of a single asset. This only needs to be run once, the masks are then read above.
 
-claire = treecover2015.lt(60)
-dense = treecover2015.gte(60)
-forest_to_split = class2015_fix1.eq(2).Or(class2015_fix1.eq(4))
-forestclaireseche = forest_to_split.eq(1).And(claire.eq(1))
-forestdenseseche = forest_to_split.eq(1).And(dense.eq(1))
+# In[ ]:
 
-class2015_fix2 = class2015_fix1.where(forestclaireseche.eq(1),4)
-class2015_fix3 = class2015_fix2.where(forestdenseseche.eq(1),2)
 
+# tree cover and elevation are continuous, they are resampled bilinearly to the export grid before the thresholds
+treecover_grid = treecover2015.resample('bilinear')
+dem_grid = dem.resample('bilinear')
+# each bit is unmasked to 0 on its own: no bit is set where its source has no data, and no tree cover does not clear the elevation bits
+terrain_bits_2015 = (treecover_grid.gte(60).multiply(1).unmask(0)  # dense forest
+                     .add(treecover_grid.lt(60).multiply(2).unmask(0))  # open forest
+                     .add(dem_grid.gte(1750).multiply(4).unmask(0))  # montane
+                     .add(dem_grid.lt(1750).And(dem_grid.gte(1100)).multiply(8).unmask(0))  # sub-montane
+                     .add(dem_grid.lte(35).multiply(16).unmask(0))  # mangroves possible
+                     .add(dem_grid.gte(35).multiply(32).unmask(0))  # no mangroves
+                     .uint8())
+terrain_bits_export = ee.batch.Export.image.toAsset(image=terrain_bits_2015,
+                                     description='treecover_dem_bits_2015',
+                                     assetId='projects/cafi_fao_congo/regional/treecover_dem_bits_2015',
+                                     pyramidingPolicy={'.default': 'sample'},  # averaging the bit flags would mix them
+                                     region=aoi,
+                                     scale=30,
+                                     crs='EPSG:3857',
+                                     maxPixels=1e13)
 
-# 5. fix montane forest based on elevation
 
-# In[10]:
+# In[ ]:
 
 
-montane = dem.gte(1750).And(class2015_fix1.eq(1))
-submontane = dem.lt(1750).And(dem.gte(1100).And(class2015_fix1.eq(1)))
-class2015_fix4 = class2015_fix3.where(submontane.eq(1),5)
-class2015_fix5 = class2015_fix4.where(montane.eq(1),6)
-gabon_mask = gabon_os.neq(128)
+#terrain_bits_export.start()
 
 
-# 6. fix mangrove based on elevation and within a 500m buffer of ESA Mangrove 2020
+# 1. Recode classes from SEPAL to Code DDD
 
-# In[13]:
+# In[6]:
 
 
-ESA_mang = ESA_worldcover.first().eq(95).clip(aoi)
-buffer_dist = 500
-mang_buffer = ESA_mang.focal_max(buffer_dist,'square','meters')
-mangarea = dem.lte(35).And(class2015_fix5.lte(12)).updateMask(mang_buffer).unmask()
-nomang = dem.gte(35).Or(countries_raster.eq(3)).unmask()
-mangadd = mangroves.eq(1).And(mangarea.eq(1)).unmask()
-mangfix = mangroves.eq(1).And(nomang.eq(1)).unmask()
-class2015_fix6 = class2015_fix5.where(mangadd.eq(1),7)
-class2015_fix7 = class2015_fix6.where(mangfix.eq(1),8)
+# lookup table indexed by the SEPAL code (1 to 15), padded to every uint8 code: index 0 and unknown codes give 0 (no data)
+reclass_lut = ee.Image(ee.Array([0,1,2,3,4,7,8,9,11,12,13,14,15,16,17,18] + [0]*240))
+classDDD = reclass_lut.arrayGet(class2015.uint8()).uint8().rename('class')
+classDDD_no_alos = reclass_lut.arrayGet(class2015_no_alos.uint8()).uint8().rename('class')
 
 
-# 7. fix water and prairies with JRC data
+# 2. fix ALOS holes
 
-# In[14]:
+# In[7]:
 
 
-prairie = seasonal.eq(1).And(class2015_fix7.neq(14).And(class2015_fix7.neq(18)))
-class2015_fixwater1 = class2015_fix7.where(prairie.eq(1),14)
-class2015_fixwater = class2015_fixwater1.where(permanent.eq(1),18).unmask()
+# the ALOS classification is used where it has a class, otherwise the classification without ALOS
+classDDD_fill = ee.ImageCollection([classDDD.selfMask(), classDDD_no_alos]).reduce(ee.Reducer.firstNonNull()).rename('class').uint8()
 
 
-# 8. add gabon and annobon data
+# 3. to 8. fix built up area, forest types, mangroves and water, then add gabon and annobon data
+# 
+# all the per-pixel corrections are applied in a single expression so that Earth Engine reads each input once. The rules are listed from the last correction applied to the first: the first rule that matches a pixel gives its final class.
 
-# In[15]:
+# In[8]:
 
 
-class2015_wgab = class2015_fixwater.where(not_gabon.neq(1),gabon_os)
-class2015_clean = class2015_wgab.where(holes.eq(1),class2015_fixwater)
-class2015_final = class2015_clean.where(anno_area.gt(0),annobon)
+cleanup_expression = (
+    # 8. add annobon and gabon data (gabon code 128 are holes, keep the regional classification)
+    "anno > 0 ? anno"
+    " : gab == 1 && gabon != 128 ? gabon"
+    # 7. fix water and prairies with JRC data
+    " : permanent == 1 ? 18"
+    " : seasonal == 1 && (c != 18 || built == 1 || (mang == 1 && (upland != 0 || (car == 1 && lowland != 0)))) ? 14"
+    # 6. fix mangrove based on elevation and within a 500m buffer of ESA Mangrove 2020 (lowland or upland is set where the dem has data)
+    " : mang == 1 && (upland != 0 || (car == 1 && lowland != 0)) ? 8"
+    " : mang == 1 && mang_buffer == 1 && lowland != 0 && built != 1 && c <= 12 ? 7"
+    # 3. fix built up area
+    " : built == 1 ? 17"
+    " : c == 17 ? 15"
+    # 4. apply treecover for closed and open forest
+    " : (c == 2 || c == 4) && dense != 0 ? 2"
+    " : (c == 2 || c == 4) && claire != 0 ? 4"
+    # 5. fix montane forest based on elevation
+    " : c == 1 && montane != 0 ? 6"
+    " : c == 1 && submontane != 0 ? 5"
+    " : c"
+)
+
+class2015_final = classDDD_fill.expression(cleanup_expression, {
+    'c': classDDD_fill,
+    'built': builtup,
+    'dense': dense,
+    'claire': claire,
+    'montane': montane,
+    'submontane': submontane,
+    'lowland': lowland,
+    'upland': upland,
+    'mang_buffer': mang_buffer,
+    'mang': mangroves,
+    'seasonal': seasonal,
+    'permanent': permanent,
+    'car': car,
+    'gab': gab,
+    'gabon': gabon_os,
+    'anno': annobon,
+}).uint8().rename('class').clip(aoi)
 
 
 # 9. apply forest definitions to cameroun and central african republic
@@ -179,9 +280,11 @@ class2015_final = class2015_clean.where(anno_area.gt(0),annobon)
 # In[16]:
 
 
-caf_sav = car_cam.eq(1).And(class2015_final.eq(12))
-fnf = class2015_final.remap([1,2,3,4,5,6,7,8,9,11,12,13,14,15,16,17,18],[1,1,1,1,1,1,1,1,1,1,2,2,2,2,2,2,3]).clip(aoi)
-fnf_final = fnf.where(caf_sav.eq(1),1).clip(lsib)
+caf_sav = car_cam.multiply(class2015_final.eq(12)).uint8()
+# lookup table indexed by the DDD code (0 to 18), padded to every uint8 code: codes 0, 10 and 19 or higher have no forest/non-forest class and are masked
+fnf_lut = ee.Image(ee.Array([0,1,1,1,1,1,1,1,1,1,0,1,2,2,2,2,2,2,3] + [0]*237))
+fnf = fnf_lut.arrayGet(class2015_final).uint8().selfMask().rename('fnf')
+fnf_final = fnf.where(caf_sav.eq(1),1).uint8().clip(lsib)
 
 
 # In[17]:
@@ -195,14 +298,16 @@ fnf_final = fnf.where(caf_sav.eq(1),1).clip(lsib)
 # In[29]:
 
 
-Map = geemap.Map()
+if __name__ == "__main__":
+    Map = geemap.Map()
 
 
 # In[30]:
 
 
-Map = geemap.Map(center=(-2, 21), zoom=5)
-Map
+if __name__ == "__main__":
+    Map = geemap.Map(center=(-2, 21), zoom=5)
+    display(Map)
 
 
 # add classification to map
@@ -237,7 +342,8 @@ class_params = {
   'max': 18,
   'palette': classpalette}
 
-Map.addLayer(class2015_final, {'min':1, 'max':19, 'palette':classpalette}, 'Classification CAFI 2015')
+if __name__ == "__main__":
+    Map.addLayer(class2015_final, {'min':1, 'max':19, 'palette':classpalette}, 'Classification CAFI 2015')
 
 
 # add forest/non forest
@@ -245,9 +351,10 @@ Map.addLayer(class2015_final, {'min':1, 'max':19, 'palette':classpalette}, 'Clas
 # In[33]:
 
 
-fnfparam = {"opacity":1,"bands":["remapped"],"palette":["0c4b13","cadea2","0a4aff"]}
+fnfparam = {"opacity":1,"bands":["fnf"],"palette":["0c4b13","cadea2","0a4aff"]}
 fnf_map =fnf_final.select('b1')
-Map.addLayer(fnf_final, fnfparam, 'Masque Forêt')
+if __name__ == "__main__":
+    Map.addLayer(fnf_final, fnfparam, 'Masque Forêt')
 
 
 # add optical mosaic
@@ -256,8 +363,8 @@ Map.addLayer(fnf_final, fnfparam, 'Masque Forêt')
 
 
 optparam = {"opacity":1,"bands":["swir1","nir","red"],"min":144,"max":3914,"gamma":1}
-optical = ee.Image("projects/cafi_fao_congo/imagery/cafi_optical_mosaic_2013_2015").select('swir1','nir','red')
-Map.addLayer(optical, optparam, 'optical mosaic')
+if __name__ == "__main__":
+    Map.addLayer(optical, optparam, 'optical mosaic')
 
 
 # In[36]:
@@ -284,13 +391,15 @@ legend_dict = {
     '18 Eau': '0000FF',
     '19 Savane Arbustive - NF':'#988558'
 }
-Map.add_legend(legend_title="CAFI Classification", legend_dict=legend_dict)
+if __name__ == "__main__":
+    Map.add_legend(legend_title="CAFI Classification", legend_dict=legend_dict)
 
 
 # In[37]:
 
 
-Map.addLayer(fnf_final, fnfparam, 'CAFI Foret/Non-Foret',False)
+if __name__ == "__main__":
+    Map.addLayer(fnf_final, fnfparam, 'CAFI Foret/Non-Foret',False)
 
 
 # ### Export results
@@ -298,47 +407,191 @@ Map.addLayer(fnf_final, fnfparam, 'CAFI Foret/Non-Foret',False)
 # In[ ]:
 
 
-classexport = ee.batch.Export.image.toDrive(image=class2015_final,  # an ee.Image object.
-                                     region=aoi,  # an ee.Geometry object.
-                                     description='cafi classification',
-                                     folder='GEE',
-                                     fileNamePrefix='LC_cafi_ddd_2015',
+# the classification and the forest mask are exported together as a 2 band image, so the cleanup is only computed once
+
+cafi_2015 = class2015_final.rename('class').addBands(fnf_final.rename('fnf'))
+cafiexport = ee.batch.Export.image.toCloudStorage(image=cafi_2015,  # an ee.Image object.
+                                     region=aoi.bounds(),  # an ee.Geometry object, the image is already clipped to the aoi.
+                                     description='cafi_classification_forest_mask',
+                                     bucket='cafi-exports',
+                                     fileNamePrefix='LC_FNF_cafi_ddd_2015',
                                      scale=30,
-                                     crs='EPSG:3857')
+                                     crs='EPSG:3857',
+                                     maxPixels=1e13,
+                                     shardSize=512,
+                                     fileDimensions=32768,
+                                     skipEmptyTiles=True,
+                                     fileFormat='GeoTIFF',
+                                     formatOptions={'cloudOptimized': True})
 
 
 # In[ ]:
 
 
-classexport.start()
+if __name__ == "__main__":
+    cafiexport.start()
 
 
 # In[ ]:
 
 
-classexport.status()
+if __name__ == "__main__":
+    cafiexport.status()
+
+
+
+# ### Local tile mode
+# 
+# To iterate on the cleanup rules without rerunning the Earth Engine graph, the inputs over a small development area (a few 4096x4096 pixel chips) are exported once to a single multiband asset, read back with [Xee](https://github.com/google/Xee) and saved locally as zarr. Steps 1 to 8 are applied to the saved copy by a parallel [Numba](https://numba.pydata.org/) kernel and step 9 with numpy, one dask block per chip. Move `dev_center` to test the rules on another area and delete the local copy to download it again.
+
+# In[ ]:
+
+
+#!pip install xee dask numba zarr
+
+
+# In[ ]:
+
+
+import os
+
+import numpy as np
+import xarray as xr
+from numba import njit, prange
 
 
 # In[ ]:
 
 
-fnfexport = ee.batch.Export.image.toDrive(image=fnf_final,  # an ee.Image object.
-                                     region=aoi,  # an ee.Geometry object.
-                                     description='cafi_forest_mask',
-                                     folder='GEE',
-                                     fileNamePrefix='FNF_cafi',
+# development area: dev_chips x dev_chips chips of 4096 30m pixels around dev_center (Gabon coast, with mangroves, water and national data)
+dev_chips = 2
+dev_center = ee.Geometry.Point([9.6, 0.4])
+dev_geometry = dev_center.buffer(dev_chips * 4096 * 30 / 2).bounds()
+local_cache = 'cafi_cleanup_inputs_dev.zarr'
+
+local_bands = ['class_alos','class_no_alos','builtup','terrain_bits','mang_buffer','mangroves','countries','gabon_os','annobon','water']
+local_inputs = ee.Image.cat([
+    class2015,
+    class2015_no_alos,
+    builtup,
+    terrain_bits,
+    mang_buffer,
+    mangroves,
+    countries,
+    gabon_os,
+    annobon,
+    water_area,
+]).rename(local_bands).int16()
+
+localexport = ee.batch.Export.image.toAsset(image=local_inputs,
+                                     description='cafi_cleanup_inputs_2015',
+                                     assetId='projects/cafi_fao_congo/regional/cafi_cleanup_inputs_2015',
+                                     pyramidingPolicy={'.default': 'sample'},  # the bands are class, country and bit codes, they must not be averaged
+                                     region=dev_geometry,
                                      scale=30,
-                                     crs='EPSG:3857')
+                                     crs='EPSG:3857',
+                                     maxPixels=1e13)
 
 
 # In[ ]:
 
 
-fnfexport.start()
+#localexport.start()
 
 
 # In[ ]:
 
 
-fnfexport.status()
+# lookup tables indexed by the class value, codes without an entry are set to 0
+reclass_table = np.zeros(256, dtype=np.uint8)
+reclass_table[:16] = [0,1,2,3,4,7,8,9,11,12,13,14,15,16,17,18]
+fnf_table = np.zeros(256, dtype=np.uint8)
+fnf_table[:19] = [0,1,1,1,1,1,1,1,1,1,0,1,2,2,2,2,2,2,3]
+
+@njit(parallel=True, fastmath=True)
+def cleanup_tile(class_alos, class_no_alos, builtup, terrain_bits, mang_buffer, mangroves, countries, gabon_os, annobon, water):
+    out = np.empty(class_alos.shape, dtype=np.uint8)
+    for i in prange(class_alos.shape[0]):
+        for j in range(class_alos.shape[1]):
+            # 1. recode classes from SEPAL to Code DDD
+            c = reclass_table[np.uint8(class_alos[i, j])]
+            # 2. fix ALOS holes
+            if c == 0:
+                c = reclass_table[np.uint8(class_no_alos[i, j])]
+            # 3. fix built up area
+            if builtup[i, j] == 1:
+                c = 17
+            elif c == 17:
+                c = 15
+            # tree cover and elevation masks, same bits as the terrain bits asset
+            bits = terrain_bits[i, j]
+            lowland = bits & 16 != 0
+            upland = bits & 32 != 0
+            # 4. apply treecover for closed and open forest
+            if c == 2 or c == 4:
+                if bits & 1:
+                    c = 2
+                elif bits & 2:
+                    c = 4
+            # 5. fix montane forest based on elevation
+            elif c == 1:
+                if bits & 4:
+                    c = 6
+                elif bits & 8:
+                    c = 5
+            # 6. fix mangrove based on elevation and within a 500m buffer of ESA Mangrove 2020
+            if mangroves[i, j] == 1:
+                if upland or (countries[i, j] == 3 and lowland):
+                    c = 8
+                elif mang_buffer[i, j] == 1 and lowland and c <= 12:
+                    c = 7
+            # 7. fix water and prairies with JRC data
+            if water[i, j] == 3:
+                c = 18
+            elif water[i, j] == 2 and c != 14 and c != 18:
+                c = 14
+            # 8. add gabon and annobon data
+            if countries[i, j] == 6 and gabon_os[i, j] != 128:
+                c = gabon_os[i, j]
+            if annobon[i, j] > 0:
+                c = annobon[i, j]
+            out[i, j] = c
+    return out
+
+def fnf_tile(c, countries):
+    # 9. apply forest definitions to cameroun and central african republic
+    caf_sav = ((countries == 2) | (countries == 3)) & (c == 12)
+    return np.where(caf_sav, 1, fnf_table[c]).astype(np.uint8)
+
+
+# In[ ]:
+
+
+# download the development area once, the rules are then rerun on the local copy without any Earth Engine request
+
+if __name__ == "__main__" and not os.path.exists(local_cache):
+    local = xr.open_dataset(ee.ImageCollection([ee.Image('projects/cafi_fao_congo/regional/cafi_cleanup_inputs_2015')]),
+                            engine='ee',
+                            crs='EPSG:3857',
+                            scale=30,
+                            geometry=dev_geometry).isel(time=0)
+    local.chunk({'X': 4096, 'Y': 4096}).to_zarr(local_cache)
+
+
+# In[ ]:
+
+
+def local_cleanup(path=local_cache):
+    local = xr.open_zarr(path)
+    local_class = xr.apply_ufunc(cleanup_tile, *[local[band] for band in local_bands],
+                                 dask='parallelized', output_dtypes=[np.uint8])
+    local_fnf = xr.apply_ufunc(fnf_tile, local_class, local['countries'],
+                               dask='parallelized', output_dtypes=[np.uint8])
+    return local_class, local_fnf
+
+
+# In[ ]:
+
 
+#local_class, local_fnf = local_cleanup()
+#local_class = local_class.compute()